@@ -4,18 +4,57 @@ import numpy as np
 import os
 import io
 import base64
+import sys
+import json
+import hashlib
+import tempfile
 from datetime import datetime
 import warnings
 from werkzeug.utils import secure_filename
 
+# Make the helper modules next to this file importable from any working directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from governor import ResourceGovernor, GovernorBusy, estimate_merge_footprint
+from streaming import stream_merge, describe_mapping, preview_records, DtypeTracker
+from column_matching import match_columns, SAMPLE_ROWS
+from upload_store import UploadStore, new_session_id
+from profiling import FrameProfiler
+from result_store import ResultStore
+
 warnings.filterwarnings('ignore')
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
 app.config['UPLOAD_FOLDER'] = '/tmp/uploads'
+app.config['SPILL_FOLDER'] = '/tmp/spill'
+app.config['RESULT_FOLDER'] = os.environ.get('RESULT_FOLDER', '/tmp/results')  # shared by all workers
+app.config['MERGE_MEMORY_BUDGET'] = int(os.environ.get('MERGE_MEMORY_BUDGET', 512 * 1024 * 1024))  # bytes for all workers
+app.config['WORKERS'] = int(os.environ.get('WEB_CONCURRENCY', 1))  # set by gunicorn.conf.py
+app.config['MERGE_QUEUE_TIMEOUT'] = float(os.environ.get('MERGE_QUEUE_TIMEOUT', 30))  # seconds
+app.config['MERGE_CHUNK_ROWS'] = 50000
+app.config['UPLOAD_TTL_SECONDS'] = int(os.environ.get('UPLOAD_TTL_SECONDS', 3600))  # idle time before a handle expires
+app.config['UPLOAD_STORE_MAX_BYTES'] = int(os.environ.get('UPLOAD_STORE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+app.config['RESULT_TTL_SECONDS'] = int(os.environ.get('RESULT_TTL_SECONDS', 3600))
+app.config['UPLOAD_GC_INTERVAL'] = 300  # seconds
 
-# Ensure upload folder exists
+# Ensure upload and spill folders exist
 os.makedirs(app.config['UPLOAD_FOLDER'], mode=0o777, exist_ok=True)
+os.makedirs(app.config['SPILL_FOLDER'], mode=0o777, exist_ok=True)
+
+# Each worker process governs its equal share of the server-wide budget
+governor = ResourceGovernor(app.config['MERGE_MEMORY_BUDGET'] // max(app.config['WORKERS'], 1),
+                            app.config['MERGE_QUEUE_TIMEOUT'])
+
+upload_store = UploadStore(
+    app.config['UPLOAD_FOLDER'],
+    ttl_seconds=app.config['UPLOAD_TTL_SECONDS'],
+    max_bytes=app.config['UPLOAD_STORE_MAX_BYTES']
+)
+upload_store.start_gc(app.config['UPLOAD_GC_INTERVAL'])
+
+result_store = ResultStore(app.config['RESULT_FOLDER'], ttl_seconds=app.config['RESULT_TTL_SECONDS'])
+result_store.start_gc(app.config['UPLOAD_GC_INTERVAL'])
 
 ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls', 'json', 'txt'}
 
@@ -23,6 +62,10 @@ def allowed_file(filename):
     """Check if file has allowed extension"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def get_session_id():
+    """Session that owns the caller's upload handles"""
+    return request.headers.get('X-Session-Id') or new_session_id()
+
 def read_file(file_path, filename):
     """Read uploaded file"""
     try:
@@ -108,18 +151,13 @@ def upload():
         if not files or files[0].filename == '':
             return jsonify({'error': 'No files selected'}), 400
         
+        session_id = get_session_id()
         uploaded_files = []
         
         for file in files:
             if file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                uploaded_files.append({
-                    'name': filename,
-                    'size': os.path.getsize(filepath),
-                    'path': filepath
-                })
+                uploaded_files.append(upload_store.put(file.stream, filename, session_id))
         
         if not uploaded_files:
             return jsonify({'error': 'No valid files uploaded'}), 400
@@ -127,108 +165,290 @@ def upload():
         return jsonify({
             'success': True,
             'message': f'{len(uploaded_files)} files uploaded successfully',
+            'session_id': session_id,
             'files': uploaded_files
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/upload/check', methods=['POST'])
+def check_upload():
+    """Attach files the server already stores by their SHA-256 hash"""
+    try:
+        data = request.get_json()
+        
+        files = data.get('files', [])
+        session_id = get_session_id()
+        
+        known_files = []
+        missing = []
+        
+        for file in files:
+            filename = secure_filename(file.get('name', ''))
+            if not allowed_file(filename):
+                continue
+            info = upload_store.attach(str(file.get('hash', '')).lower(), file.get('size'), filename, session_id)
+            if info:
+                known_files.append(info)
+            else:
+                missing.append(file.get('name'))
+        
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'files': known_files,
+            'missing': missing
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/release', methods=['POST'])
+def release():
+    """Release upload handles the client no longer needs"""
+    try:
+        data = request.get_json()
+        
+        released = upload_store.release(data.get('file_handles', []), get_session_id())
+        
+        return jsonify({'success': True, 'released': released}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def merge_fingerprint(session_id, inputs, merge_method, add_source, handle_duplicates, column_matching):
+    """Stable id for a session's merge of (content_hash, filename) inputs with given options.
+
+    The session id is part of the key, so ids cannot be derived from the
+    inputs alone and sessions never share or overwrite each other's results.
+    """
+    key = json.dumps([session_id, inputs, merge_method, add_source, handle_duplicates, column_matching])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def merge_dataframes(sources, merge_method, add_source, handle_duplicates, column_matching='exact'):
+    """Merge (file_path, filename) sources in memory"""
+    # Read all files
+    dataframes = []
+    read_sources = []
+    for filepath, filename in sources:
+        df = read_file(filepath, filename)
+        if df is not None:
+            if add_source:
+                df['_source_file'] = filename
+            dataframes.append(df)
+            read_sources.append((filepath, filename))
+    
+    if not dataframes:
+        return None, 0, []
+    
+    # Rename similar headers onto shared names so they line up in the concat
+    column_mapping = []
+    if column_matching in ('fuzzy', 'fuzzy_values'):
+        samples = [df.head(SAMPLE_ROWS) for df in dataframes] if column_matching == 'fuzzy_values' else None
+        renames = match_columns([list(df.columns) for df in dataframes], samples)
+        dataframes = [df.rename(columns=rename) if rename else df for df, rename in zip(dataframes, renames)]
+        column_mapping = describe_mapping(read_sources, renames)
+    
+    # Merge based on method
+    if "Common Columns" in merge_method:
+        common_cols = set(dataframes[0].columns)
+        for df in dataframes[1:]:
+            common_cols = common_cols.intersection(set(df.columns))
+        
+        if add_source and '_source_file' in common_cols:
+            common_cols.discard('_source_file')
+        
+        # Keep the first file's column order so output is deterministic
+        common_cols = [col for col in dataframes[0].columns if col in common_cols]
+        
+        aligned_dfs = []
+        for df in dataframes:
+            cols_to_keep = [col for col in common_cols if col in df.columns]
+            if add_source and '_source_file' in df.columns:
+                cols_to_keep.append('_source_file')
+            aligned_dfs.append(df[cols_to_keep].copy())
+        
+        merged_df = pd.concat(aligned_dfs, ignore_index=True)
+        pieces = aligned_dfs
+    
+    elif "All Columns" in merge_method:
+        merged_df = pd.concat(dataframes, ignore_index=True, sort=False)
+        pieces = dataframes
+    
+    else:
+        merged_df = pd.concat(dataframes, ignore_index=True)
+        pieces = dataframes
+    
+    # Use the same column dtypes as the streaming merge so both paths write
+    # and deduplicate identical values
+    tracker = DtypeTracker(merged_df.columns)
+    for df in pieces:
+        tracker.update(df)
+    merged_df = merged_df.astype(tracker.dtypes())
+    
+    # Handle duplicates
+    if handle_duplicates == "Remove Exact Duplicates":
+        merged_df = merged_df.drop_duplicates()
+    elif handle_duplicates == "Keep First":
+        merged_df = merged_df.drop_duplicates(keep='first')
+    elif handle_duplicates == "Keep Last":
+        merged_df = merged_df.drop_duplicates(keep='last')
+    
+    return merged_df, len(dataframes), column_mapping
+
 @app.route('/api/merge', methods=['POST'])
 def merge():
     """Handle file merging"""
     try:
         data = request.get_json()
         
-        file_paths = data.get('file_paths', [])
+        file_handles = data.get('file_handles', [])
         merge_method = data.get('merge_method', 'Append Rows (Common Columns Only)')
         add_source = data.get('add_source', True)
         handle_duplicates = data.get('handle_duplicates', 'Remove Exact Duplicates')
+        include_stats = data.get('include_stats', False)
+        column_matching = data.get('column_matching', 'exact')
         
-        if not file_paths:
+        if not file_handles:
             return jsonify({'error': 'No files provided'}), 400
         
-        # Read all files
-        dataframes = []
-        for filepath in file_paths:
-            filename = os.path.basename(filepath)
-            df = read_file(filepath, filename)
-            if df is not None:
-                if add_source:
-                    df['_source_file'] = filename
-                dataframes.append(df)
-        
-        if not dataframes:
-            return jsonify({'error': 'No valid files could be read'}), 400
-        
-        # Merge based on method
-        if "Common Columns" in merge_method:
-            common_cols = set(dataframes[0].columns)
-            for df in dataframes[1:]:
-                common_cols = common_cols.intersection(set(df.columns))
-            
-            if add_source and '_source_file' in common_cols:
-                common_cols.discard('_source_file')
-            
-            common_cols = list(common_cols)
-            
-            aligned_dfs = []
-            for df in dataframes:
-                cols_to_keep = [col for col in common_cols if col in df.columns]
-                if add_source and '_source_file' in df.columns:
-                    cols_to_keep.append('_source_file')
-                aligned_dfs.append(df[cols_to_keep].copy())
-            
-            merged_df = pd.concat(aligned_dfs, ignore_index=True)
+        session_id = get_session_id()
+        sources = []
+        inputs = []
+        for handle in file_handles:
+            resolved = upload_store.resolve(handle, session_id)
+            if resolved is None:
+                return jsonify({'error': 'Uploaded file has expired, please upload it again'}), 400
+            blob_path, filename, file_hash = resolved
+            sources.append((blob_path, filename))
+            inputs.append((file_hash, filename))
         
-        elif "All Columns" in merge_method:
-            merged_df = pd.concat(dataframes, ignore_index=True, sort=False)
+        merge_id = merge_fingerprint(session_id, inputs, merge_method, add_source, handle_duplicates, column_matching)
         
-        else:
-            merged_df = pd.concat(dataframes, ignore_index=True)
+        # Results are keyed by content, so any worker can serve a repeated merge
+        stored = result_store.get(merge_id, session_id)
+        if stored and (stored['profile'] or not include_stats):
+            return jsonify({
+                'success': True,
+                'message': 'Files merged successfully',
+                'merge_id': merge_id,
+                'stats': stored['stats'],
+                'profile': stored['profile'],
+                'column_mapping': stored['column_mapping'],
+                'resources': {'execution_mode': 'cached', 'estimated_bytes': 0, 'reserved_bytes': 0, 'budget_bytes': governor.budget_bytes, 'queued_seconds': 0},
+                'preview': stored['preview']
+            }), 200
         
-        # Handle duplicates
-        if handle_duplicates == "Remove Exact Duplicates":
-            merged_df = merged_df.drop_duplicates()
-        elif handle_duplicates == "Keep First":
-            merged_df = merged_df.drop_duplicates(keep='first')
-        elif handle_duplicates == "Keep Last":
-            merged_df = merged_df.drop_duplicates(keep='last')
+        profiler = FrameProfiler() if include_stats else None
         
-        # Store in session (in production, use database or cache)
-        merged_data_json = merged_df.head(1000).to_json(orient='records')
+        # Estimate memory before reading anything and let the governor pick a mode
+        estimate = estimate_merge_footprint(sources, app.config['MERGE_CHUNK_ROWS'])
+        
+        with governor.admit(estimate['estimated_bytes'], estimate['streaming_bytes']) as admission:
+            resources = dict(admission, files=estimate['files'])
+            
+            if admission['execution_mode'] == 'streaming':
+                result = stream_merge(
+                    sources, merge_method, add_source, handle_duplicates, read_file,
+                    chunk_rows=app.config['MERGE_CHUNK_ROWS'],
+                    spill_dir=app.config['SPILL_FOLDER'],
+                    output_dir=result_store.temp_dir,
+                    profiler=profiler,
+                    column_matching=column_matching
+                )
+                if result is None:
+                    return jsonify({'error': 'No valid files could be read'}), 400
+                
+                csv_path = result['path']
+                stats = {
+                    'rows': result['rows'],
+                    'columns': result['columns'],
+                    'files_merged': result['files_merged']
+                }
+                preview = result['preview']
+                column_mapping = result['column_mapping']
+            
+            else:
+                merged_df, files_merged, column_mapping = merge_dataframes(
+                    sources, merge_method, add_source, handle_duplicates, column_matching
+                )
+                if merged_df is None:
+                    return jsonify({'error': 'No valid files could be read'}), 400
+                
+                stats = {
+                    'rows': len(merged_df),
+                    'columns': len(merged_df.columns),
+                    'files_merged': files_merged
+                }
+                preview = preview_records(merged_df)
+                fd, csv_path = tempfile.mkstemp(suffix='.csv', dir=result_store.temp_dir)
+                with os.fdopen(fd, 'w', encoding='utf-8', newline='') as out:
+                    merged_df.to_csv(out, index=False)
+                if profiler is not None:
+                    profiler.update(merged_df)
+        
+        profile = profiler.result() if profiler is not None else None
+        result_store.put(merge_id, session_id, csv_path, stats, preview, profile, column_mapping)
         
         return jsonify({
             'success': True,
             'message': 'Files merged successfully',
-            'stats': {
-                'rows': len(merged_df),
-                'columns': len(merged_df.columns),
-                'files_merged': len(dataframes)
-            },
-            'preview': merged_df.head(20).to_dict('records'),
-            'merged_data': base64.b64encode(merged_df.to_csv(index=False).encode()).decode()
+            'merge_id': merge_id,
+            'stats': stats,
+            'profile': profile,
+            'column_mapping': column_mapping,
+            'resources': resources,
+            'preview': preview
         }), 200
         
+    except GovernorBusy as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/stats/<merge_id>', methods=['GET'])
+def merge_stats(merge_id):
+    """Return the stored column profile of a previous merge"""
+    stored = result_store.get(merge_id, get_session_id())
+    if stored is None or stored['profile'] is None:
+        return jsonify({'error': 'No statistics for this merge, run it again with statistics enabled'}), 404
+    return jsonify({'success': True, 'merge_id': merge_id, 'profile': stored['profile']}), 200
+
 @app.route('/api/download', methods=['POST'])
 def download():
     """Handle file download"""
     try:
         data = request.get_json()
         
+        merge_id = data.get('merge_id')
         merged_data_b64 = data.get('merged_data')
         filename = data.get('filename', 'merged_data')
         file_format = data.get('format', 'csv')
         
-        if not merged_data_b64:
+        if merge_id:
+            stored = result_store.get(merge_id, get_session_id())
+            if stored is None:
+                return jsonify({'error': 'Merged result has expired, please merge again'}), 404
+            if file_format == 'csv':
+                # The stored result already is the CSV, so send it without parsing
+                return send_file(stored['path'], mimetype='text/csv', as_attachment=True,
+                                 download_name=f"{filename}.csv")
+            download_info = prepare_download_data(pd.read_csv(stored['path']), file_format)
+            if not download_info:
+                return jsonify({'error': 'Failed to prepare download'}), 500
+            file_data = download_info['data']
+            if isinstance(file_data, str):
+                file_data = file_data.encode('utf-8')
+            return send_file(io.BytesIO(file_data), mimetype=download_info['mime_type'], as_attachment=True,
+                             download_name=f"{filename}.{download_info['file_extension']}")
+        elif merged_data_b64:
+            # Decode merged data sent back by older clients
+            csv_data = base64.b64decode(merged_data_b64).decode()
+            df = pd.read_csv(io.StringIO(csv_data))
+        else:
             return jsonify({'error': 'No data to download'}), 400
         
-        # Decode merged data
-        csv_data = base64.b64decode(merged_data_b64).decode()
-        df = pd.read_csv(io.StringIO(csv_data))
-        
         # Prepare download
         download_info = prepare_download_data(df, file_format)
         
@@ -0,0 +1,115 @@
+import re
+
+import numpy as np
+
+SOURCE_COLUMN = '_source_file'
+
+# Names scoring at least this are the same column, provided the shorter
+# covers at least NAME_COVERAGE_THRESHOLD of the longer; a near miss such as
+# total_amount against total_amount_tax needs its values checked instead
+NAME_MATCH_THRESHOLD = 0.8
+NAME_COVERAGE_THRESHOLD = 0.9
+# Names scoring between this and NAME_MATCH_THRESHOLD match only when a
+# sample of their values overlaps as well
+VALUE_CHECK_THRESHOLD = 0.5
+VALUE_OVERLAP_THRESHOLD = 0.3
+SAMPLE_ROWS = 200
+
+NON_WORD = re.compile(r'[\W_]+')
+DIGITS = re.compile(r'\d+')
+
+
+def normalize_name(name):
+    """Reduce a header to casefolded letters and digits of any script:
+    'Customer ID' -> 'customerid', 'Код_Клиента' -> 'кодклиента'"""
+    return NON_WORD.sub('', str(name).casefold())
+
+
+def similarity_matrix(keys):
+    """Cosine similarity of character trigram profiles for every pair of keys"""
+    grams = [[padded[i:i + 3] for i in range(len(padded) - 2)] for padded in (f'#{key}#' for key in keys)]
+    vocabulary = {}
+    for key_grams in grams:
+        for gram in key_grams:
+            vocabulary.setdefault(gram, len(vocabulary))
+
+    rows = np.repeat(np.arange(len(keys)), [len(key_grams) for key_grams in grams])
+    cols = np.array([vocabulary[gram] for key_grams in grams for gram in key_grams], dtype=np.intp)
+    vectors = np.zeros((len(keys), max(len(vocabulary), 1)))
+    np.add.at(vectors, (rows, cols), 1.0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1.0, norms)
+
+    scores = vectors @ vectors.T
+    # Headers that differ only in their numbers (Q1/Q2, extra_0/extra_1) are
+    # distinct columns however similar the rest of the name is
+    number_ids = {}
+    numbers = np.array([number_ids.setdefault(tuple(DIGITS.findall(key)), len(number_ids)) for key in keys])
+    scores[numbers[:, None] != numbers[None, :]] = 0.0
+    np.fill_diagonal(scores, 1.0)
+    return scores
+
+
+def value_overlap(left, right):
+    """Jaccard overlap of the distinct values in two column samples"""
+    left_values = set(left.dropna().astype(str))
+    right_values = set(right.dropna().astype(str))
+    if not left_values or not right_values:
+        return 0.0
+    return len(left_values & right_values) / len(left_values | right_values)
+
+
+def match_columns(headers, samples=None):
+    """Map each file's headers onto shared canonical column names.
+
+    headers holds one list of column names per file; samples, if given, holds
+    a DataFrame sample per file used to confirm borderline name matches.
+    Columns are assigned greedily by score to the canonical columns seen so
+    far, never two columns of one file to the same canonical column, and a
+    canonical column takes the name it first appeared under. Returns one
+    {original: canonical} dict per file holding only the renamed columns.
+    """
+    keys = sorted({normalize_name(col) for cols in headers for col in cols if col != SOURCE_COLUMN})
+    key_index = {key: i for i, key in enumerate(keys)}
+    scores = similarity_matrix(keys)
+
+    canonical = []  # (name, key index, file index, original column)
+    mappings = []
+    for file_index, cols in enumerate(headers):
+        cols = [col for col in cols if col != SOURCE_COLUMN]
+        candidates = []
+        for col in cols:
+            col_key = key_index[normalize_name(col)]
+            for slot, (_, canon_key, canon_file, canon_col) in enumerate(canonical):
+                # Headers of only punctuation normalise to '' and say nothing
+                # about each other, so they match only under the same name
+                if not keys[col_key] and col != canon_col:
+                    continue
+                score = scores[col_key, canon_key]
+                lengths = len(keys[col_key]), len(keys[canon_key])
+                coverage = min(lengths) / max(max(lengths), 1)
+                if score >= NAME_MATCH_THRESHOLD and coverage >= NAME_COVERAGE_THRESHOLD:
+                    candidates.append((score, col, slot))
+                elif score >= VALUE_CHECK_THRESHOLD and samples is not None:
+                    overlap = value_overlap(samples[file_index][col], samples[canon_file][canon_col])
+                    if overlap >= VALUE_OVERLAP_THRESHOLD:
+                        candidates.append((score, col, slot))
+
+        mapping = {}
+        taken = set()
+        # Best scores first; on ties an identical name wins so it is never
+        # displaced and left clashing with the column renamed onto it
+        for score, col, slot in sorted(candidates, key=lambda c: (-c[0], c[1] != canonical[c[2]][0])):
+            if col in mapping or slot in taken:
+                continue
+            mapping[col] = canonical[slot][0]
+            taken.add(slot)
+
+        for col in cols:
+            if col not in mapping:
+                canonical.append((col, key_index[normalize_name(col)], file_index, col))
+                mapping[col] = col
+
+        mappings.append({col: name for col, name in mapping.items() if col != name})
+
+    return mappings
@@ -0,0 +1,23 @@
+import sqlite3
+from contextlib import contextmanager
+
+
+@contextmanager
+def connect(db_path):
+    """Yield an SQLite connection, committing any open transaction on success.
+
+    Connections are opened per call so they can be used from request threads,
+    the GC thread and other worker processes alike.
+    """
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,175 @@
+import os
+import io
+import time
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+# How much larger a file becomes once pandas has parsed it, used when the
+# schema cannot be sniffed cheaply
+EXPANSION_FACTORS = {
+    '.csv': 3.0,
+    '.txt': 3.0,
+    '.json': 4.0,
+    '.xlsx': 10.0,
+    '.xls': 6.0,
+}
+DEFAULT_EXPANSION_FACTOR = 10.0
+
+# Bytes read from the head of a text file to sniff its schema
+SNIFF_BYTES = 256 * 1024
+SNIFF_ROWS = 500
+
+# Average in-memory size of a parsed spreadsheet cell (mostly object dtype)
+EXCEL_CELL_BYTES = 64
+
+# pd.concat and drop_duplicates each hold a full copy next to the inputs
+MERGE_OVERHEAD_FACTOR = 2.0
+
+# Formats the streaming merge reads in chunks; anything else is parsed whole
+CHUNKED_FORMATS = {'csv', 'txt'}
+
+# Per-row hash and keep mask held by a deduplicating streaming merge
+STREAM_ROW_BYTES = 16
+
+
+class GovernorBusy(Exception):
+    """Raised when not even a streaming merge fits before the queue timeout"""
+
+
+def sniff_file(file_path, filename):
+    """Estimate the in-memory footprint of a file from its size and schema"""
+    file_ext = os.path.splitext(filename)[1].lower()
+    size = os.path.getsize(file_path)
+    info = {
+        'name': filename,
+        'size': size,
+        'format': file_ext.lstrip('.'),
+        'columns': None,
+        'estimated_rows': None,
+        'estimated_bytes': int(size * EXPANSION_FACTORS.get(file_ext, DEFAULT_EXPANSION_FACTOR))
+    }
+
+    try:
+        if file_ext in ['.csv', '.txt']:
+            with open(file_path, 'rb') as fh:
+                head = fh.read(SNIFF_BYTES)
+            # Drop the trailing partial line so the sample parses cleanly
+            if len(head) == SNIFF_BYTES and b'\n' in head:
+                head = head[:head.rfind(b'\n') + 1]
+
+            sample = pd.read_csv(io.BytesIO(head), nrows=SNIFF_ROWS)
+            if len(sample) > 0:
+                sample_lines = head.count(b'\n') or 1
+                bytes_per_line = len(head) / sample_lines
+                row_bytes = sample.memory_usage(deep=True, index=False).sum() / len(sample)
+                estimated_rows = int(size / bytes_per_line)
+                info['estimated_rows'] = estimated_rows
+                info['estimated_bytes'] = int(estimated_rows * row_bytes)
+            info['columns'] = len(sample.columns)
+
+        elif file_ext == '.xlsx':
+            from openpyxl import load_workbook
+            # Stored uploads have no extension, which openpyxl rejects by path
+            with open(file_path, 'rb') as fh:
+                workbook = load_workbook(fh, read_only=True)
+                try:
+                    sheet = workbook.worksheets[0]
+                    rows, cols = sheet.max_row or 0, sheet.max_column or 0
+                finally:
+                    workbook.close()
+            info['columns'] = cols
+            info['estimated_rows'] = max(rows - 1, 0)
+            # openpyxl's own parse overhead dominates small sheets
+            info['estimated_bytes'] = max(int(rows * cols * EXCEL_CELL_BYTES), info['estimated_bytes'])
+
+    except Exception:
+        pass
+
+    return info
+
+
+def streaming_footprint(info, chunk_rows):
+    """Peak memory for one file in a streaming merge: a chunk, or the whole
+    file for formats pandas cannot read incrementally"""
+    if info['format'] in CHUNKED_FORMATS and info['estimated_rows']:
+        row_bytes = info['estimated_bytes'] / info['estimated_rows']
+        return int(min(info['estimated_bytes'], row_bytes * chunk_rows))
+    return info['estimated_bytes']
+
+
+def estimate_merge_footprint(sources, chunk_rows=50000):
+    """Estimate peak memory for merging (file_path, filename) sources,
+    both in memory and as a streaming merge"""
+    files = [sniff_file(file_path, filename) for file_path, filename in sources if os.path.exists(file_path)]
+    total_rows = sum(f['estimated_rows'] or 0 for f in files)
+    largest = max((streaming_footprint(f, chunk_rows) for f in files), default=0)
+    return {
+        'files': files,
+        'estimated_bytes': int(sum(f['estimated_bytes'] for f in files) * MERGE_OVERHEAD_FACTOR),
+        'streaming_bytes': int(largest * MERGE_OVERHEAD_FACTOR + total_rows * STREAM_ROW_BYTES)
+    }
+
+
+class ResourceGovernor:
+    """Per-process memory budget shared by concurrent merges.
+
+    A merge whose estimate fits the free budget runs in memory straight away.
+    One that fits the total budget but not what is currently free waits up to
+    queue_timeout seconds for other merges to finish. Anything larger, or a
+    merge whose wait timed out, is switched to streaming mode and reserves
+    only its streaming estimate, roughly its largest file. A streaming merge
+    larger than the whole budget still runs once nothing else does.
+    """
+
+    def __init__(self, budget_bytes, queue_timeout=30):
+        self.budget_bytes = budget_bytes
+        self.queue_timeout = queue_timeout
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+    def _reserve(self, nbytes, deadline, when_idle=False):
+        """Wait until nbytes fits the free budget and take it; False on timeout"""
+        with self._cond:
+            while self._in_use + nbytes > self.budget_bytes and not (when_idle and self._in_use == 0):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._in_use += nbytes
+            return True
+
+    @contextmanager
+    def admit(self, estimated_bytes, streaming_bytes=0):
+        """Reserve budget for a merge and yield the admission decision"""
+        started = time.monotonic()
+        mode = 'in_memory'
+        reserved = estimated_bytes
+
+        if estimated_bytes > self.budget_bytes or \
+                not self._reserve(estimated_bytes, started + self.queue_timeout):
+            mode = 'streaming'
+            reserved = streaming_bytes
+            if not self._reserve(streaming_bytes, time.monotonic() + self.queue_timeout, when_idle=True):
+                raise GovernorBusy('Server is busy with other merges, please retry shortly')
+
+        decision = {
+            'execution_mode': mode,
+            'estimated_bytes': estimated_bytes,
+            'reserved_bytes': reserved,
+            'budget_bytes': self.budget_bytes,
+            'queued_seconds': round(time.monotonic() - started, 3)
+        }
+
+        try:
+            yield decision
+        finally:
+            if reserved:
+                with self._cond:
+                    self._in_use -= reserved
+                    self._cond.notify_all()
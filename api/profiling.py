@@ -0,0 +1,159 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+SOURCE_COLUMN = '_source_file'
+
+# Columns with more distinct values than this switch from an exact count
+# to the HyperLogLog estimate
+EXACT_DISTINCT_LIMIT = 100000
+
+# 2**12 registers gives a standard error of about 1.6%
+HLL_PRECISION = 12
+
+DTYPE_KIND_NAMES = {
+    'b': 'bool',
+    'i': 'int',
+    'u': 'int',
+    'f': 'float',
+    'c': 'complex',
+    'M': 'datetime',
+    'm': 'timedelta',
+}
+
+
+def hll_update(registers, hashes, precision=HLL_PRECISION):
+    """Fold 64-bit hashes into HyperLogLog registers in place"""
+    if len(hashes) == 0:
+        return
+    value_bits = 64 - precision
+    index = (hashes >> np.uint64(value_bits)).astype(np.intp)
+    remainder = hashes & np.uint64((1 << value_bits) - 1)
+    # Position of the leftmost set bit within the remaining bits
+    _, bit_length = np.frexp(remainder.astype(np.float64))
+    rank = (value_bits - bit_length + 1).astype(np.uint8)
+    np.maximum.at(registers, index, rank)
+
+
+def hll_estimate(registers):
+    """Cardinality estimate with the small-range correction"""
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def to_json_value(value):
+    """Convert numpy and pandas scalars into JSON-friendly Python values"""
+    if value is None:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    # Timestamps, dates, times, Decimals and anything else go out as text
+    return str(value)
+
+
+class ColumnProfile:
+    """Running null, distinct, min/max and type counts for one column"""
+
+    def __init__(self, name):
+        self.name = name
+        self.nulls = 0
+        self.types = {}
+        self.min = None
+        self.max = None
+        self.registers = np.zeros(1 << HLL_PRECISION, dtype=np.uint8)
+        self.exact = np.empty(0, dtype=np.uint64)
+
+    def update(self, series):
+        values = series.dropna()
+        self.nulls += len(series) - len(values)
+        if len(values) == 0:
+            return
+
+        if pd.api.types.is_string_dtype(values.dtype) and values.dtype != object:
+            self.types['str'] = self.types.get('str', 0) + len(values)
+            comparable = True
+        elif values.dtype == object:
+            type_counts = values.map(type).value_counts()
+            for value_type, count in type_counts.items():
+                type_name = value_type.__name__
+                self.types[type_name] = self.types.get(type_name, 0) + int(count)
+            # Mixed object columns have no meaningful ordering
+            comparable = len(type_counts) == 1
+        else:
+            type_name = DTYPE_KIND_NAMES.get(values.dtype.kind, str(values.dtype))
+            self.types[type_name] = self.types.get(type_name, 0) + len(values)
+            comparable = values.dtype.kind in 'biufMm'
+
+        if comparable:
+            try:
+                low, high = values.min(), values.max()
+                self.min = low if self.min is None else min(self.min, low)
+                self.max = high if self.max is None else max(self.max, high)
+            except TypeError:
+                pass
+
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        hll_update(self.registers, hashes)
+        if self.exact is not None:
+            self.exact = np.union1d(self.exact, hashes)
+            if len(self.exact) > EXACT_DISTINCT_LIMIT:
+                self.exact = None
+
+    def result(self, rows):
+        approximate = self.exact is None
+        # Chunks of one column may parse as int and float, but any other
+        # mix of types has no common ordering
+        ordered = len(self.types) == 1 or set(self.types) <= {'bool', 'int', 'float'}
+        return {
+            'name': self.name,
+            'nulls': self.nulls,
+            'null_pct': round(100.0 * self.nulls / rows, 2) if rows else 0.0,
+            'distinct': hll_estimate(self.registers) if approximate else len(self.exact),
+            'distinct_approximate': approximate,
+            'min': to_json_value(self.min) if ordered else None,
+            'max': to_json_value(self.max) if ordered else None,
+            'types': self.types
+        }
+
+
+class FrameProfiler:
+    """Column statistics accumulated over one frame or a stream of chunks.
+
+    The in-memory merge feeds the whole merged frame once; the streaming merge
+    feeds each chunk as it is written. Both produce the same summary.
+    """
+
+    def __init__(self, source_column=SOURCE_COLUMN):
+        self.source_column = source_column
+        self.rows = 0
+        self.columns = OrderedDict()
+        self.source_rows = {}
+
+    def update(self, df):
+        self.rows += len(df)
+        for name in df.columns:
+            if name not in self.columns:
+                self.columns[name] = ColumnProfile(name)
+            self.columns[name].update(df[name])
+
+        if self.source_column in df.columns:
+            for source, count in df[self.source_column].value_counts().items():
+                self.source_rows[source] = self.source_rows.get(source, 0) + int(count)
+
+    def result(self):
+        return {
+            'rows': self.rows,
+            'columns': [profile.result(self.rows) for profile in self.columns.values()],
+            'source_rows': self.source_rows
+        }
+
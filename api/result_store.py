@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import threading
+
+from db import connect
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    merge_id TEXT PRIMARY KEY,
+    session TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    columns INTEGER NOT NULL,
+    files_merged INTEGER NOT NULL,
+    preview TEXT NOT NULL,
+    profile TEXT,
+    column_mapping TEXT,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results(last_used);
+"""
+
+
+class ResultStore:
+    """Merged results on local disk, shared by every worker process.
+
+    Each result is a CSV file named after its merge id plus an SQLite row
+    with its owning session, stats, preview and optional column profile, so
+    a merge run on one worker can be downloaded or profiled through any
+    other, but only by the session that ran it. Results unused for
+    ttl_seconds are removed by collect().
+    """
+
+    def __init__(self, root, ttl_seconds=3600):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.db_path = os.path.join(root, 'results.db')
+        # Results are written here first, on the same filesystem as root so
+        # put() can move them into place with an atomic rename
+        self.temp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.temp_dir, mode=0o777, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return connect(self.db_path)
+
+    def data_path(self, merge_id):
+        return os.path.join(self.root, f'{merge_id}.csv')
+
+    def put(self, merge_id, session, csv_path, stats, preview, profile=None, column_mapping=None):
+        """Move a merged CSV from temp_dir into the store and record its metadata"""
+        os.replace(csv_path, self.data_path(merge_id))
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT OR REPLACE INTO results '
+                '(merge_id, session, rows, columns, files_merged, preview, profile, column_mapping, created, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (merge_id, session, stats['rows'], stats['columns'], stats['files_merged'], json.dumps(preview),
+                 json.dumps(profile) if profile is not None else None, json.dumps(column_mapping or []), now, now)
+            )
+
+    def get(self, merge_id, session):
+        """Return a session's stored result metadata and data path, or None"""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT * FROM results WHERE merge_id = ? AND session = ?',
+                               (merge_id, session)).fetchone()
+            if row is None or not os.path.exists(self.data_path(merge_id)):
+                return None
+            conn.execute('UPDATE results SET last_used = ? WHERE merge_id = ?', (time.time(), merge_id))
+
+        return {
+            'merge_id': merge_id,
+            'path': self.data_path(merge_id),
+            'stats': {
+                'rows': row['rows'],
+                'columns': row['columns'],
+                'files_merged': row['files_merged']
+            },
+            'preview': json.loads(row['preview']),
+            'profile': json.loads(row['profile']) if row['profile'] else None,
+            'column_mapping': json.loads(row['column_mapping']) if row['column_mapping'] else []
+        }
+
+    def collect(self, now=None):
+        """Delete results unused for longer than the TTL and abandoned temp files"""
+        now = time.time() if now is None else now
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            expired = conn.execute('SELECT merge_id FROM results WHERE last_used < ?',
+                                   (now - self.ttl_seconds,)).fetchall()
+            for row in expired:
+                conn.execute('DELETE FROM results WHERE merge_id = ?', (row['merge_id'],))
+                try:
+                    os.remove(self.data_path(row['merge_id']))
+                except FileNotFoundError:
+                    pass
+
+        # Left behind by merges that failed before put()
+        stale = 0
+        for name in os.listdir(self.temp_dir):
+            path = os.path.join(self.temp_dir, name)
+            try:
+                if os.path.getmtime(path) < now - self.ttl_seconds:
+                    os.remove(path)
+                    stale += 1
+            except FileNotFoundError:
+                pass
+        return {'expired_results': len(expired), 'stale_temp_files': stale}
+
+    def start_gc(self, interval):
+        """Run collect() every interval seconds on a daemon thread"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.collect()
+                except Exception:
+                    pass
+
+        thread = threading.Thread(target=loop, name='result-store-gc', daemon=True)
+        thread.start()
+        return thread
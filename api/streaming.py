@@ -0,0 +1,292 @@
+import os
+import json
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from column_matching import match_columns, SAMPLE_ROWS
+
+SOURCE_COLUMN = '_source_file'
+DEDUP_KEEP = {
+    'Remove Exact Duplicates': 'first',
+    'Keep First': 'first',
+    'Keep Last': 'last',
+}
+
+
+class ChunkCache:
+    """Parsed chunks of files pandas cannot read incrementally.
+
+    Spreadsheets and JSON are parsed once, holding at most one whole file in
+    memory, and spilled to disk as pickled chunks so the later passes of a
+    streaming merge re-read them instead of parsing the file again.
+    """
+
+    def __init__(self, reader, chunk_rows, spill_dir=None):
+        self.reader = reader
+        self.chunk_rows = chunk_rows
+        self.spill_dir = spill_dir
+        self.paths = {}
+
+    def load(self, file_path, filename):
+        """Parse a file whole into the cache; False if it cannot be read"""
+        if file_path not in self.paths:
+            self.paths[file_path] = self._spill(file_path, filename)
+        return self.paths[file_path] is not None
+
+    def chunks(self, file_path, filename):
+        if not self.load(file_path, filename):
+            return
+        with open(self.paths[file_path], 'rb') as fh:
+            while True:
+                try:
+                    yield pickle.load(fh)
+                except EOFError:
+                    return
+
+    def _spill(self, file_path, filename):
+        df = self.reader(file_path, filename)
+        if df is None:
+            return None
+        fd, path = tempfile.mkstemp(suffix='.chunks', dir=self.spill_dir)
+        with os.fdopen(fd, 'wb') as out:
+            # An empty frame still records the columns
+            for start in range(0, max(len(df), 1), self.chunk_rows):
+                pickle.dump(df.iloc[start:start + self.chunk_rows], out, protocol=pickle.HIGHEST_PROTOCOL)
+        return path
+
+    def close(self):
+        for path in self.paths.values():
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+        self.paths = {}
+
+
+def read_sample(file_path, filename, cache, nrows=0):
+    """Return the first nrows of a file without loading it where possible"""
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_path not in cache.paths:
+        try:
+            if file_ext in ['.csv', '.txt']:
+                return pd.read_csv(file_path, nrows=nrows)
+            if file_ext in ['.xlsx', '.xls']:
+                return pd.read_excel(file_path, nrows=nrows)
+        except Exception:
+            pass
+    for chunk in cache.chunks(file_path, filename):
+        return chunk.head(nrows)
+    return None
+
+
+def iter_chunks(file_path, filename, cache, chunk_rows):
+    """Yield a file as DataFrames of at most chunk_rows rows"""
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext in ['.csv', '.txt'] and file_path not in cache.paths:
+        yield from pd.read_csv(file_path, chunksize=chunk_rows)
+        return
+    yield from cache.chunks(file_path, filename)
+
+
+def resolve_columns(headers, merge_method, add_source):
+    """Output columns for a merge, mirroring the in-memory concat rules"""
+    if add_source:
+        headers = [cols + [SOURCE_COLUMN] for cols in headers]
+
+    if "Common Columns" in merge_method:
+        others = [set(cols) for cols in headers[1:]]
+        columns = [col for col in headers[0]
+                   if col != SOURCE_COLUMN and all(col in cols for cols in others)]
+        if add_source:
+            columns.append(SOURCE_COLUMN)
+        return columns
+
+    # pd.concat with sort=False keeps columns in order of first appearance
+    columns = []
+    seen = set()
+    for cols in headers:
+        for col in cols:
+            if col not in seen:
+                seen.add(col)
+                columns.append(col)
+    return columns
+
+
+class DtypeTracker:
+    """Agree on one dtype per output column across every piece of a merge.
+
+    Pieces of a column can parse differently, e.g. int in one file and float
+    in another where a blank cell forced NaN. Both merge paths cast to these
+    dtypes so they write and deduplicate identical values.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.seen = {col: set() for col in self.columns}
+        self.has_na = dict.fromkeys(self.columns, False)
+
+    def update(self, frame):
+        if len(frame) == 0:
+            return
+        for col in self.columns:
+            if col not in frame.columns:
+                self.has_na[col] = True
+                continue
+            series = frame[col]
+            nulls = int(series.isna().sum())
+            if nulls:
+                self.has_na[col] = True
+            if nulls < len(series):
+                self.seen[col].add(series.dtype)
+
+    def dtypes(self):
+        result = {}
+        for col in self.columns:
+            dtypes = self.seen[col]
+            kinds = {dtype.kind for dtype in dtypes}
+            if not dtypes:
+                result[col] = np.dtype('float64')
+            elif (kinds <= set('iuf') and len(dtypes) > 1) or (kinds <= set('iu') and self.has_na[col]):
+                result[col] = np.dtype('float64')
+            elif len(dtypes) == 1 and not (kinds == {'b'} and self.has_na[col]):
+                result[col] = next(iter(dtypes))
+            else:
+                result[col] = np.dtype('object')
+        return result
+
+
+def preview_records(df, rows=20):
+    """First rows of a frame as JSON-safe records, dates in ISO format"""
+    return json.loads(df.head(rows).to_json(orient='records', date_format='iso'))
+
+
+def describe_mapping(sources, renames):
+    """Renames applied per file, in the shape returned to clients"""
+    return [{'file': filename, 'renamed': rename}
+            for (_, filename), rename in zip(sources, renames) if rename]
+
+
+def stream_merge(sources, merge_method, add_source, handle_duplicates, reader,
+                 chunk_rows=50000, spill_dir=None, profiler=None, column_matching='exact', output_dir=None):
+    """Merge (file_path, filename) sources chunk by chunk into a CSV in
+    output_dir (default spill_dir), spilling intermediate chunks to spill_dir.
+
+    A first pass settles the dtype of every column and a second, when
+    deduplicating, keeps only a 64-bit hash per row, so memory stays
+    proportional to one chunk plus eight bytes per row. Spreadsheets and
+    JSON cannot be read in chunks, so each is parsed once into a ChunkCache
+    and only the largest of them is ever held in memory.
+    When a profiler is given it is fed every chunk that is written.
+    column_matching 'fuzzy' renames similar headers onto shared names before
+    aligning, and 'fuzzy_values' also checks value samples for weak matches.
+    Returns None when no source could be read.
+    """
+    cache = ChunkCache(reader, chunk_rows, spill_dir)
+    try:
+        return _stream_merge(sources, merge_method, add_source, handle_duplicates, cache,
+                             chunk_rows, output_dir or spill_dir, profiler, column_matching)
+    finally:
+        cache.close()
+
+
+def _stream_merge(sources, merge_method, add_source, handle_duplicates, cache,
+                  chunk_rows, output_dir, profiler, column_matching):
+    sample_rows = SAMPLE_ROWS if column_matching == 'fuzzy_values' else 0
+    readable = []
+    samples = []
+    for file_path, filename in sources:
+        sample = read_sample(file_path, filename, cache, sample_rows)
+        if sample is not None:
+            readable.append((file_path, filename))
+            samples.append(sample)
+
+    if not readable:
+        return None
+
+    def file_chunks(file_path, filename, rename):
+        for chunk in iter_chunks(file_path, filename, cache, chunk_rows):
+            if rename:
+                chunk = chunk.rename(columns=rename)
+            if add_source:
+                chunk = chunk.assign(**{SOURCE_COLUMN: filename})
+            yield chunk.reindex(columns=columns)
+
+    # The dtype pass is the first to parse every file in full. A CSV can fail
+    # past its sample, e.g. on a row with an extra field; it is then read
+    # whole like read_file does, or dropped if that fails too, and the
+    # columns are worked out again without it.
+    while True:
+        headers = [list(sample.columns) for sample in samples]
+        renames = [{} for _ in headers]
+        if column_matching in ('fuzzy', 'fuzzy_values'):
+            renames = match_columns(headers, samples if sample_rows else None)
+            headers = [[rename.get(col, col) for col in cols] for cols, rename in zip(headers, renames)]
+
+        columns = resolve_columns(headers, merge_method, add_source)
+        tracker = DtypeTracker(columns)
+        failed = None
+        for index, ((file_path, filename), rename) in enumerate(zip(readable, renames)):
+            try:
+                for chunk in file_chunks(file_path, filename, rename):
+                    tracker.update(chunk)
+            except Exception:
+                failed = index
+                break
+
+        if failed is None:
+            break
+        file_path, filename = readable[failed]
+        if file_path not in cache.paths and cache.load(file_path, filename):
+            samples[failed] = read_sample(file_path, filename, cache, sample_rows)
+        else:
+            del readable[failed]
+            del samples[failed]
+            if not readable:
+                return None
+
+    dtypes = tracker.dtypes()
+
+    def aligned_chunks():
+        for (file_path, filename), rename in zip(readable, renames):
+            yield from file_chunks(file_path, filename, rename)
+
+    def typed_chunks():
+        for chunk in aligned_chunks():
+            yield chunk.astype(dtypes)
+
+    keep_mask = None
+    keep = DEDUP_KEEP.get(handle_duplicates)
+    if keep:
+        hashes = [pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+                  for chunk in typed_chunks()]
+        if hashes:
+            all_hashes = pd.Series(np.concatenate(hashes))
+            keep_mask = (~all_hashes.duplicated(keep=keep)).to_numpy()
+
+    fd, spill_path = tempfile.mkstemp(suffix='.csv', dir=output_dir)
+    rows = 0
+    offset = 0
+    preview = []
+    with os.fdopen(fd, 'w', encoding='utf-8', newline='') as out:
+        pd.DataFrame(columns=columns).to_csv(out, index=False)
+        for chunk in typed_chunks():
+            if keep_mask is not None:
+                chunk_mask = keep_mask[offset:offset + len(chunk)]
+                offset += len(chunk)
+                chunk = chunk[chunk_mask]
+            chunk.to_csv(out, index=False, header=False)
+            if profiler is not None:
+                profiler.update(chunk)
+            rows += len(chunk)
+            if rows - len(chunk) < 20:
+                preview.append(chunk.head(20))
+
+    return {
+        'path': spill_path,
+        'rows': rows,
+        'columns': len(columns),
+        'files_merged': len(readable),
+        'column_mapping': describe_mapping(readable, renames),
+        'preview': preview_records(pd.concat(preview)) if preview else []
+    }
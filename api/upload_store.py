@@ -0,0 +1,216 @@
+import os
+import time
+import uuid
+import hashlib
+import secrets
+import tempfile
+import threading
+
+from db import connect
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS handles (
+    handle TEXT PRIMARY KEY,
+    session TEXT NOT NULL,
+    hash TEXT NOT NULL REFERENCES blobs(hash),
+    filename TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS handles_hash ON handles(hash);
+CREATE INDEX IF NOT EXISTS handles_last_used ON handles(last_used);
+"""
+
+
+def new_session_id():
+    """Generate an id for a client that has not been given one yet"""
+    return uuid.uuid4().hex
+
+
+class UploadStore:
+    """Content-addressed upload storage shared by every worker.
+
+    File bodies are stored once under objects/ keyed by their SHA-256, and an
+    SQLite index maps per-session handles onto them. Each blob counts the
+    handles pointing at it; collect() drops handles unused for ttl_seconds.
+    Blobs nobody references stay cached, so the same file can be attached
+    again without uploading, until they are unused for ttl_seconds or are
+    evicted least recently used first while the store is over max_bytes.
+    A blob that a handle still references is never deleted, so the store
+    may exceed max_bytes while every blob is in use.
+    """
+
+    def __init__(self, root, ttl_seconds=3600, max_bytes=2 * 1024 * 1024 * 1024):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, 'objects')
+        self.db_path = os.path.join(root, 'index.db')
+        os.makedirs(self.objects_dir, mode=0o777, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return connect(self.db_path)
+
+    def blob_path(self, file_hash):
+        return os.path.join(self.objects_dir, file_hash[:2], file_hash)
+
+    def put(self, stream, filename, session):
+        """Store an uploaded file stream and return a handle for it"""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: stream.read(HASH_CHUNK_BYTES), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+
+            file_hash = digest.hexdigest()
+            with self._connect() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                known = conn.execute('SELECT 1 FROM blobs WHERE hash = ?', (file_hash,)).fetchone()
+                if not known:
+                    path = self.blob_path(file_hash)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(tmp_path, path)
+                    conn.execute('INSERT INTO blobs (hash, size, refcount, last_used) VALUES (?, ?, 0, ?)',
+                                 (file_hash, size, time.time()))
+                info = self._add_handle(conn, file_hash, filename, session)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        info['deduplicated'] = bool(known)
+        return info
+
+    def attach(self, file_hash, size, filename, session):
+        """Create a handle for content the store already holds, or None"""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            known = conn.execute('SELECT 1 FROM blobs WHERE hash = ? AND size = ?',
+                                 (file_hash, size)).fetchone()
+            if not known:
+                return None
+            info = self._add_handle(conn, file_hash, filename, session)
+
+        info['deduplicated'] = True
+        return info
+
+    def _add_handle(self, conn, file_hash, filename, session):
+        now = time.time()
+        handle = secrets.token_urlsafe(16)
+        conn.execute('INSERT INTO handles (handle, session, hash, filename, created, last_used) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', (handle, session, file_hash, filename, now, now))
+        conn.execute('UPDATE blobs SET refcount = refcount + 1, last_used = ? WHERE hash = ?',
+                     (now, file_hash))
+        size = conn.execute('SELECT size FROM blobs WHERE hash = ?', (file_hash,)).fetchone()['size']
+        return {'handle': handle, 'hash': file_hash, 'name': filename, 'size': size}
+
+    def resolve(self, handle, session):
+        """Return (blob_path, filename, hash) for a session's handle, or None"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT hash, filename FROM handles WHERE handle = ? AND session = ?',
+                               (handle, session)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE handles SET last_used = ? WHERE handle = ?', (now, handle))
+            conn.execute('UPDATE blobs SET last_used = ? WHERE hash = ?', (now, row['hash']))
+        return self.blob_path(row['hash']), row['filename'], row['hash']
+
+    def release(self, handles, session):
+        """Drop a session's handles; returns how many were released"""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            released = 0
+            for handle in handles:
+                released += self._drop_handle(conn, handle, session)
+        return released
+
+    def _drop_handle(self, conn, handle, session=None):
+        query = 'SELECT hash FROM handles WHERE handle = ?'
+        params = (handle,)
+        if session is not None:
+            query += ' AND session = ?'
+            params = (handle, session)
+        row = conn.execute(query, params).fetchone()
+        if row is None:
+            return 0
+        conn.execute('DELETE FROM handles WHERE handle = ?', (handle,))
+        conn.execute('UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?', (row['hash'],))
+        return 1
+
+    def _delete_blob(self, conn, file_hash):
+        conn.execute('DELETE FROM handles WHERE hash = ?', (file_hash,))
+        conn.execute('DELETE FROM blobs WHERE hash = ?', (file_hash,))
+        # Removed while the write lock is held so a concurrent put() of the
+        # same content cannot have its fresh file deleted underneath it
+        try:
+            os.remove(self.blob_path(file_hash))
+        except FileNotFoundError:
+            pass
+
+    def collect(self, now=None):
+        """Expire idle handles and delete idle or excess unreferenced blobs"""
+        now = time.time() if now is None else now
+        expired = 0
+        deleted = 0
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            cutoff = now - self.ttl_seconds
+            for row in conn.execute('SELECT handle FROM handles WHERE last_used < ?', (cutoff,)).fetchall():
+                expired += self._drop_handle(conn, row['handle'])
+
+            for row in conn.execute('SELECT hash FROM blobs WHERE refcount <= 0 AND last_used < ?',
+                                    (cutoff,)).fetchall():
+                self._delete_blob(conn, row['hash'])
+                deleted += 1
+
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) AS total FROM blobs').fetchone()['total']
+            if total > self.max_bytes:
+                for row in conn.execute('SELECT hash, size FROM blobs WHERE refcount <= 0 '
+                                        'ORDER BY last_used').fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._delete_blob(conn, row['hash'])
+                    total -= row['size']
+                    deleted += 1
+
+        # Partial writes left behind by interrupted uploads
+        for name in os.listdir(self.objects_dir):
+            path = os.path.join(self.objects_dir, name)
+            if name.endswith('.part') and os.path.getmtime(path) < now - self.ttl_seconds:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+        return {'expired_handles': expired, 'deleted_blobs': deleted, 'stored_bytes': total}
+
+    def start_gc(self, interval):
+        """Run collect() every interval seconds on a daemon thread"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.collect()
+                except Exception:
+                    pass
+
+        thread = threading.Thread(target=loop, name='upload-store-gc', daemon=True)
+        thread.start()
+        return thread
+
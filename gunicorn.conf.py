@@ -0,0 +1,36 @@
+# Production server configuration: gunicorn -c gunicorn.conf.py
+#
+# Workers are forked processes that share uploads and merge results through
+# the SQLite-backed stores under /tmp, so a merge run on one worker can be
+# downloaded from any other. MERGE_MEMORY_BUDGET is the budget for the whole
+# server; each worker takes an equal share of it. Threads within a worker
+# share that worker's governor, so concurrent merges queue for its share.
+import multiprocessing
+import os
+
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+wsgi_app = 'index:app'
+
+bind = os.environ.get('BIND', '0.0.0.0:' + os.environ.get('PORT', '3000'))
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Large merges can legitimately take minutes
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+graceful_timeout = 30
+
+# Recycle workers periodically to return memory fragmented by pandas
+max_requests = 500
+max_requests_jitter = 50
+
+# Each worker imports the app itself so its store GC threads run after fork
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Workers import the app after forking and split MERGE_MEMORY_BUDGET by
+    # this, so pass on the final worker count including command line overrides
+    os.environ['WEB_CONCURRENCY'] = str(server.cfg.workers)
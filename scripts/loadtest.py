@@ -0,0 +1,171 @@
+"""Merge throughput load test for the multi-worker production server.
+
+Starts gunicorn with gunicorn.conf.py once per worker count, uploads a set of
+generated CSV files, then keeps a fixed number of clients merging random
+ordered subsets of them for a fixed time. A sample of the merges is then
+downloaded on new connections, which land on arbitrary workers, to check
+that results are shared between them.
+
+    python scripts/loadtest.py --workers 1,2,4 --duration 20 --concurrency 8
+"""
+import os
+import csv
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def generate_files(directory, count, rows):
+    rng = random.Random(42)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f'part_{i:02d}.csv')
+        with open(path, 'w', newline='') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(['customer_id', 'region', 'amount', 'quantity', f'extra_{i % 3}'])
+            for _ in range(rows):
+                writer.writerow([rng.randint(1, rows), rng.choice('NSEW'), round(rng.random() * 1000, 2),
+                                 rng.randint(1, 20), rng.random()])
+        paths.append(path)
+    return paths
+
+
+def request_json(url, payload=None, headers=None, timeout=300):
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json', **(headers or {})})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+def upload(base_url, paths):
+    boundary = 'loadtest-boundary'
+    body = b''
+    for path in paths:
+        with open(path, 'rb') as fh:
+            content = fh.read()
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="files"; '
+                 f'filename="{os.path.basename(path)}"\r\nContent-Type: text/csv\r\n\r\n').encode()
+        body += content + b'\r\n'
+    body += f'--{boundary}--\r\n'.encode()
+    req = urllib.request.Request(f'{base_url}/api/upload', data=body,
+                                 headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    with urllib.request.urlopen(req, timeout=300) as resp:
+        result = json.loads(resp.read())
+    return result['session_id'], [f['handle'] for f in result['files']]
+
+
+def wait_until_healthy(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f'{base_url}/health', timeout=2):
+                return
+        except OSError:
+            time.sleep(0.3)
+    raise RuntimeError('server did not become healthy')
+
+
+def run_clients(base_url, session_id, handles, duration, concurrency):
+    headers = {'X-Session-Id': session_id}
+    deadline = time.time() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        latencies, merge_ids, errors = [], [], 0
+        while time.time() < deadline:
+            # Random ordered subsets give distinct merge ids, so results are not cached
+            subset = rng.sample(handles, rng.randint(3, min(6, len(handles))))
+            started = time.time()
+            try:
+                result = request_json(f'{base_url}/api/merge', {
+                    'file_handles': subset,
+                    'merge_method': 'Append Rows (Common Columns Only)',
+                    'handle_duplicates': 'Keep All'
+                }, headers)
+                merge_ids.append(result['merge_id'])
+                latencies.append(time.time() - started)
+            except Exception:
+                errors += 1
+        return latencies, merge_ids, errors
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(client, range(concurrency)))
+
+    latencies = [lat for outcome in outcomes for lat in outcome[0]]
+    merge_ids = [merge_id for outcome in outcomes for merge_id in outcome[1]]
+    errors = sum(outcome[2] for outcome in outcomes)
+    return latencies, merge_ids, errors
+
+
+def verify_downloads(base_url, session_id, merge_ids, sample=40):
+    failures = 0
+    for merge_id in random.sample(merge_ids, min(sample, len(merge_ids))):
+        try:
+            req = urllib.request.Request(f'{base_url}/api/download',
+                                         data=json.dumps({'merge_id': merge_id, 'format': 'csv'}).encode(),
+                                         headers={'Content-Type': 'application/json', 'X-Session-Id': session_id})
+            with urllib.request.urlopen(req, timeout=300) as resp:
+                header = resp.readline()
+            failures += 0 if resp.status == 200 and b'customer_id' in header else 1
+        except Exception:
+            failures += 1
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4', help='comma separated worker counts')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load per worker count')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--files', type=int, default=12)
+    parser.add_argument('--rows', type=int, default=20000, help='rows per generated file')
+    parser.add_argument('--port', type=int, default=3900)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='merge-loadtest-')
+    paths = generate_files(workdir, args.files, args.rows)
+    base_url = f'http://127.0.0.1:{args.port}'
+
+    print(f'{os.cpu_count()} CPUs, {args.files} files x {args.rows} rows, '
+          f'{args.concurrency} clients, {args.duration:g}s per run')
+    print(f'{"workers":>8} {"merges":>8} {"errors":>7} {"merges/s":>9} {"p50 s":>7} {"p95 s":>7} {"downloads ok":>13}')
+
+    try:
+        for workers in [int(w) for w in args.workers.split(',')]:
+            env = dict(os.environ,
+                       WEB_CONCURRENCY=str(workers),
+                       BIND=f'127.0.0.1:{args.port}',
+                       RESULT_FOLDER=os.path.join(workdir, f'results-{workers}'))
+            server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                                       '--access-logfile', os.devnull],
+                                      cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_until_healthy(base_url)
+                session_id, handles = upload(base_url, paths)
+                latencies, merge_ids, errors = run_clients(base_url, session_id, handles,
+                                                           args.duration, args.concurrency)
+                failures = verify_downloads(base_url, session_id, merge_ids)
+                checked = min(40, len(merge_ids))
+                p50 = statistics.median(latencies) if latencies else float('nan')
+                p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else float('nan')
+                print(f'{workers:>8} {len(latencies):>8} {errors:>7} {len(latencies) / args.duration:>9.2f} '
+                      f'{p50:>7.2f} {p95:>7.2f} {f"{checked - failures}/{checked}":>13}')
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()